@@ -16,6 +16,7 @@ import mimetypes
 import re
 from facenet_pytorch import InceptionResnetV1, MTCNN
 import torch
+from gallery_shards import ShardedGallery
 
 # Configure logging
 logging.basicConfig(
@@ -35,7 +36,7 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', logge
 
 # Initialize MongoDB client
 try:
-    client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=5000)
+    client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'), serverSelectionTimeoutMS=5000)
     client.admin.command('ping')
     db = client['facial_recognition_db']
     collection = db['faces']
@@ -59,6 +60,21 @@ device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 facenet = InceptionResnetV1(pretrained='vggface2').to(device).eval()
 mtcnn = MTCNN(keep_all=False, device=device)  # For face alignment
 
+# Optional sharded gallery: comma-separated 'host:port' list of shard workers
+gallery_shards = os.environ.get('GALLERY_SHARDS', '').strip()
+shard_addresses = [a.strip() for a in gallery_shards.split(',') if a.strip()]
+gallery = None
+if gallery_shards and not shard_addresses:
+    logger.error(f"GALLERY_SHARDS={gallery_shards!r} lists no shard addresses; falling back to MongoDB scan")
+elif shard_addresses:
+    try:
+        gallery = ShardedGallery(shard_addresses)
+    except ValueError as e:
+        logger.error(f"Sharded gallery setup failed: {e}")
+        exit(1)
+if gallery:
+    logger.info(f"Using sharded gallery across {gallery.num_shards} shard(s)")
+
 def check_system_resources():
     """Check available system resources."""
     memory = psutil.virtual_memory()
@@ -224,6 +240,13 @@ def register_face():
             "created_at": timestamp
         })
         
+        if gallery:
+            try:
+                gallery.add(name, embedding_list)
+            except Exception as e:
+                # The face is already in MongoDB; the shard picks it up when it reloads on restart
+                logger.error(f"Failed to add {name} to gallery shard: {e}")
+        
         socketio.emit('face_registered', {
             'message': f'Successfully registered {name}',
             'id': str(result.inserted_id),
@@ -292,6 +315,13 @@ def register_face_file():
             "created_at": timestamp
         })
         
+        if gallery:
+            try:
+                gallery.add(name, embedding_list)
+            except Exception as e:
+                # The face is already in MongoDB; the shard picks it up when it reloads on restart
+                logger.error(f"Failed to add {name} to gallery shard: {e}")
+        
         socketio.emit('face_registered', {
             'message': f'Successfully registered {name} via file upload',
             'id': str(result.inserted_id),
@@ -346,12 +376,12 @@ def recognize_face():
                 'count': 0
             })
         
-        known_faces = list(collection.find(
+        known_faces = [] if gallery else list(collection.find(
             {"name": {"$ne": "No Faces Registered"}, "encoding": {"$exists": True, "$ne": []}},
             {'name': 1, 'encoding': 1}
         ))
         
-        if not known_faces:
+        if not gallery and not known_faces:
             return jsonify({
                 'success': True,
                 'message': 'No registered faces found',
@@ -362,16 +392,27 @@ def recognize_face():
         results = []
         threshold = 1.0  # FaceNet embeddings typically use a higher threshold (e.g., 1.0 for Euclidean distance)
         
+        embedded_faces = []
         for face_location in face_locations:
             embedding = get_face_embedding(image_np, face_location)
-            if embedding is None:
-                continue
-            
+            if embedding is not None:
+                embedded_faces.append((face_location, embedding))
+        
+        gallery_matches = []
+        if gallery and embedded_faces:
+            # One scatter-gather for every face in the frame; the coordinator merges with the same threshold
+            gallery_matches = gallery.search([embedding for _, embedding in embedded_faces], k=1, threshold=threshold)
+        
+        for i, (face_location, embedding) in enumerate(embedded_faces):
             top, right, bottom, left = face_location
             name = 'Unknown'
             confidence = 0.0
             min_distance = float('inf')
             
+            if gallery_matches and gallery_matches[i]:
+                min_distance, name = gallery_matches[i][0]
+                confidence = max(0, 1.0 - (min_distance / threshold))
+            
             for known_face in known_faces:
                 try:
                     if 'encoding' not in known_face or not isinstance(known_face['encoding'], list):
@@ -538,8 +579,12 @@ def handle_disconnect():
     logger.info('Client disconnected from WebSocket')
 
 @socketio.on('ping')
-def handle_ping():
-    emit('pong', {'timestamp': datetime.now().isoformat()})
+def handle_ping(data=None):
+    response = {'timestamp': datetime.now().isoformat()}
+    # Echo a client-supplied sequence number so pongs can be matched to pings
+    if isinstance(data, dict) and 'seq' in data:
+        response['seq'] = data['seq']
+    emit('pong', response)
 
 if __name__ == '__main__':
     logger.info("Starting Flask application...")
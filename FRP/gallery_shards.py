@@ -0,0 +1,393 @@
+import argparse
+import heapq
+import logging
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+from threading import BoundedSemaphore, Lock, Thread
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 512  # FaceNet embeddings are 512-dimensional
+DEFAULT_THRESHOLD = 1.0  # Same Euclidean threshold recognize_face uses
+HANDSHAKE_TIMEOUT = 5.0  # Seconds a peer gets to complete authentication
+
+
+def get_authkey():
+    """Return the shared shard authkey from GALLERY_SHARD_AUTHKEY.
+
+    multiprocessing.connection unpickles what it receives, so the key is
+    what stops arbitrary peers from running code on a shard host. There
+    is deliberately no built-in default.
+    """
+    authkey = os.environ.get('GALLERY_SHARD_AUTHKEY', '')
+    if not authkey:
+        raise ValueError("GALLERY_SHARD_AUTHKEY must be set to use the sharded gallery")
+    return authkey.encode()
+
+
+def shard_for_name(name, num_shards):
+    """Return the shard index that owns a given identity name."""
+    # crc32 is stable across processes and hosts, unlike hash()
+    return zlib.crc32(name.encode('utf-8')) % num_shards
+
+
+def parse_address(address):
+    """Parse a 'host:port' string into a (host, port) tuple."""
+    host, _, port = address.rpartition(':')
+    return (host or 'localhost', int(port))
+
+
+class GalleryShard:
+    """In-memory slice of the embedding gallery held by one worker."""
+
+    def __init__(self):
+        self.names = []
+        self.embeddings = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self.sq_norms = np.empty(0, dtype=np.float32)  # Cached ||e||^2 per row
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def load(self, entries):
+        """Replace the shard contents with (name, encoding) pairs."""
+        names = []
+        rows = []
+        for name, encoding in entries:
+            embedding = np.asarray(encoding, dtype=np.float32)
+            if embedding.shape != (EMBEDDING_DIM,):
+                logger.warning(f"Skipping {name}: unexpected embedding shape {embedding.shape}")
+                continue
+            names.append(name)
+            rows.append(embedding)
+        matrix = np.vstack(rows) if rows else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        sq_norms = np.einsum('nd,nd->n', matrix, matrix)
+        with self.lock:
+            self.names = names
+            self.embeddings = matrix
+            self.sq_norms = sq_norms
+
+    def add(self, name, encoding):
+        """Add a single identity to the shard."""
+        embedding = np.asarray(encoding, dtype=np.float32)
+        if embedding.shape != (EMBEDDING_DIM,):
+            raise ValueError(f"Unexpected embedding shape {embedding.shape}")
+        with self.lock:
+            self.names = self.names + [name]
+            self.embeddings = np.vstack([self.embeddings, embedding[np.newaxis, :]])
+            self.sq_norms = np.append(self.sq_norms, np.dot(embedding, embedding))
+
+    def remove(self, name):
+        """Remove an identity from the shard, returning True if it was present."""
+        with self.lock:
+            keep = [i for i, n in enumerate(self.names) if n != name]
+            if len(keep) == len(self.names):
+                return False
+            self.names = [self.names[i] for i in keep]
+            self.embeddings = self.embeddings[keep]
+            self.sq_norms = self.sq_norms[keep]
+            return True
+
+    def search(self, queries, k=1, threshold=DEFAULT_THRESHOLD):
+        """Return the k nearest identities under threshold for each query.
+
+        Each result list holds (distance, name) pairs ordered by distance,
+        then name, so that shards and the coordinator break ties the same way.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        with self.lock:
+            names = self.names
+            embeddings = self.embeddings
+            sq_norms = self.sq_norms
+        if not names:
+            return [[] for _ in range(len(queries))]
+
+        # ||q - e||^2 = ||q||^2 + ||e||^2 - 2 q.e keeps memory at q x n rather than q x n x d
+        sq_distances = np.einsum('qd,qd->q', queries, queries)[:, np.newaxis] + sq_norms[np.newaxis, :]
+        sq_distances -= 2.0 * (queries @ embeddings.T)
+        np.maximum(sq_distances, 0.0, out=sq_distances)
+
+        results = []
+        for row in sq_distances:
+            candidates = np.flatnonzero(row < threshold * threshold)
+            if len(candidates) > k:
+                # Keep everything tied with the k-th distance so the name tie-break stays exact
+                kth = row[candidates[np.argpartition(row[candidates], k - 1)[k - 1]]]
+                candidates = candidates[row[candidates] <= kth]
+            matches = sorted((float(np.sqrt(row[i])), names[i]) for i in candidates)
+            results.append(matches[:k])
+        return results
+
+
+def load_partition_from_mongo(collection, shard_index, num_shards):
+    """Stream the registered faces owned by one shard out of MongoDB."""
+    cursor = collection.find(
+        {"name": {"$ne": "No Faces Registered"}, "encoding": {"$exists": True, "$ne": []}},
+        {'name': 1, 'encoding': 1}
+    )
+    for doc in cursor:
+        if shard_for_name(doc['name'], num_shards) == shard_index:
+            yield doc['name'], doc['encoding']
+
+
+class _TimedHandshake:
+    """Connection wrapper whose reads fail if the peer stalls mid-handshake."""
+
+    def __init__(self, conn, timeout):
+        self.conn = conn
+        self.timeout = timeout
+
+    def send_bytes(self, data):
+        self.conn.send_bytes(data)
+
+    def recv_bytes(self, maxlength=None):
+        if not self.conn.poll(self.timeout):
+            raise TimeoutError(f"Peer did not complete authentication within {self.timeout}s")
+        return self.conn.recv_bytes(maxlength)
+
+
+def _handle_connection(conn, shard, authkey, identity):
+    """Authenticate one coordinator connection, then serve it until it closes."""
+    try:
+        # Authenticate here rather than in accept() so a bad or silent peer
+        # only costs this thread, never the accept loop
+        try:
+            handshake = _TimedHandshake(conn, HANDSHAKE_TIMEOUT)
+            deliver_challenge(handshake, authkey)
+            answer_challenge(handshake, authkey)
+        except (EOFError, OSError, AuthenticationError) as e:
+            logger.warning(f"Rejected gallery shard connection: {e!r}")
+            return
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            command = message[0]
+            try:
+                if command == 'search':
+                    _, queries, k, threshold = message
+                    conn.send(('ok', shard.search(queries, k, threshold)))
+                elif command == 'add':
+                    _, name, encoding = message
+                    shard.add(name, encoding)
+                    conn.send(('ok', len(shard)))
+                elif command == 'remove':
+                    _, name = message
+                    conn.send(('ok', shard.remove(name)))
+                elif command == 'load':
+                    _, entries = message
+                    shard.load(entries)
+                    conn.send(('ok', len(shard)))
+                elif command == 'size':
+                    conn.send(('ok', len(shard)))
+                elif command == 'info':
+                    conn.send(('ok', identity))
+                else:
+                    conn.send(('error', f'Unknown command: {command}'))
+            except Exception as e:
+                logger.error(f"Shard command '{command}' failed: {e}")
+                conn.send(('error', str(e)))
+    finally:
+        conn.close()
+
+
+def serve_shard(address, shard_index, num_shards, authkey=None, mongo_uri=None):
+    """Run a shard worker that answers coordinator requests on address."""
+    authkey = authkey or get_authkey()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    shard = GalleryShard()
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+        collection = client['facial_recognition_db']['faces']
+        shard.load(load_partition_from_mongo(collection, shard_index, num_shards))
+
+    # No authkey on the Listener: _handle_connection authenticates each peer
+    listener = Listener(address)
+    logger.info(f"Gallery shard {shard_index}/{num_shards} serving {len(shard)} faces on {address[0]}:{address[1]}")
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError as e:
+                logger.warning(f"Gallery shard accept failed: {e}")
+                continue
+            Thread(target=_handle_connection, args=(conn, shard, authkey, (shard_index, num_shards)), daemon=True).start()
+    finally:
+        listener.close()
+
+
+class ShardedGallery:
+    """Coordinator that scatters queries to every shard and merges the results.
+
+    Each shard gets a pool of up to pool_size connections, so concurrent
+    Flask requests search the shards in parallel instead of queueing on a
+    single connection.
+    """
+
+    def __init__(self, addresses, authkey=None, timeout=5.0, pool_size=4):
+        self.addresses = [parse_address(a) if isinstance(a, str) else tuple(a) for a in addresses]
+        if not self.addresses:
+            raise ValueError("At least one gallery shard address is required")
+        self.authkey = authkey or get_authkey()
+        self.timeout = timeout
+        self.idle_connections = [[] for _ in self.addresses]
+        self.pool_locks = [Lock() for _ in self.addresses]
+        self.slots = [BoundedSemaphore(pool_size) for _ in self.addresses]
+        self.executor = ThreadPoolExecutor(max_workers=len(self.addresses) * pool_size)
+
+    @property
+    def num_shards(self):
+        return len(self.addresses)
+
+    def _call(self, shard_index, message):
+        """Send one request to a shard and wait for its reply."""
+        with self.slots[shard_index]:
+            with self.pool_locks[shard_index]:
+                idle = self.idle_connections[shard_index]
+                conn = idle.pop() if idle else None
+            try:
+                if conn is None:
+                    conn = Client(self.addresses[shard_index], authkey=self.authkey)
+                    self._check_identity(conn, shard_index)
+                conn.send(message)
+                if not conn.poll(self.timeout):
+                    raise TimeoutError(f"Shard {shard_index} did not reply within {self.timeout}s")
+                status, payload = conn.recv()
+            except Exception:
+                # Drop the connection so a later call reconnects cleanly
+                if conn is not None:
+                    conn.close()
+                raise
+            with self.pool_locks[shard_index]:
+                self.idle_connections[shard_index].append(conn)
+        if status != 'ok':
+            raise RuntimeError(f"Shard {shard_index} error: {payload}")
+        return payload
+
+    def _check_identity(self, conn, shard_index):
+        """Refuse a shard whose partitioning disagrees with its place in the address list.
+
+        Writes are routed by crc32(name) % num_shards to the list position,
+        so a worker started with another --index or --num-shards would
+        receive names it does not own and lose them on reload.
+        """
+        conn.send(('info',))
+        if not conn.poll(self.timeout):
+            raise TimeoutError(f"Shard {shard_index} did not reply within {self.timeout}s")
+        status, identity = conn.recv()
+        if status != 'ok' or tuple(identity) != (shard_index, self.num_shards):
+            raise RuntimeError(
+                f"Shard at {self.addresses[shard_index][0]}:{self.addresses[shard_index][1]} reports "
+                f"index/num_shards {identity}, expected {(shard_index, self.num_shards)}; "
+                "check that GALLERY_SHARDS lists the workers in --index order"
+            )
+
+    def search(self, queries, k=1, threshold=DEFAULT_THRESHOLD):
+        """Return the global top-k (distance, name) matches for each query."""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        message = ('search', queries, k, threshold)
+        futures = [self.executor.submit(self._call, i, message) for i in range(self.num_shards)]
+
+        per_shard = []
+        failed = 0
+        for i, future in enumerate(futures):
+            try:
+                per_shard.append(future.result())
+            except Exception as e:
+                failed += 1
+                logger.error(f"Gallery shard {i} search failed: {e}")
+        if not per_shard:
+            raise RuntimeError(f"All {self.num_shards} gallery shards failed")
+        if failed:
+            # A missing shard degrades recall instead of failing the request
+            logger.warning(f"{failed}/{self.num_shards} gallery shards failed; results may be incomplete")
+
+        merged = []
+        for q in range(len(queries)):
+            candidates = heapq.merge(*(results[q] for results in per_shard))
+            merged.append([match for match, _ in zip(candidates, range(k))])
+        return merged
+
+    def match(self, embedding, threshold=DEFAULT_THRESHOLD):
+        """Return (name, distance) of the best match, or ('Unknown', inf)."""
+        matches = self.search([embedding], k=1, threshold=threshold)[0]
+        if not matches:
+            return 'Unknown', float('inf')
+        dist, name = matches[0]
+        return name, dist
+
+    def add(self, name, encoding):
+        """Register an identity on the shard that owns its name."""
+        return self._call(shard_for_name(name, self.num_shards), ('add', name, list(encoding)))
+
+    def remove(self, name):
+        """Remove an identity from the shard that owns its name."""
+        return self._call(shard_for_name(name, self.num_shards), ('remove', name))
+
+    def load(self, entries):
+        """Partition (name, encoding) pairs by owner and load each shard."""
+        partitions = [[] for _ in range(self.num_shards)]
+        for name, encoding in entries:
+            partitions[shard_for_name(name, self.num_shards)].append((name, list(encoding)))
+        return [self._call(i, ('load', partition)) for i, partition in enumerate(partitions)]
+
+    def sizes(self):
+        """Return the number of identities held by each shard."""
+        return [self._call(i, ('size',)) for i in range(self.num_shards)]
+
+    def close(self):
+        for lock, idle in zip(self.pool_locks, self.idle_connections):
+            with lock:
+                for conn in idle:
+                    conn.close()
+                idle.clear()
+        self.executor.shutdown(wait=False)
+
+
+def spawn_local_shards(num_shards, host='127.0.0.1', base_port=6100, authkey=None, mongo_uri=None, ports=None):
+    """Start num_shards worker processes on this machine for local testing.
+
+    Workers listen on base_port, base_port + 1, ... unless explicit ports
+    are given. Returns the started processes and their 'host:port' addresses.
+    """
+    authkey = authkey or get_authkey()
+    ports = ports or [base_port + i for i in range(num_shards)]
+    processes = []
+    addresses = []
+    for i, port in enumerate(ports):
+        process = Process(
+            target=serve_shard,
+            args=((host, port), i, num_shards, authkey, mongo_uri),
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+        addresses.append(f'{host}:{port}')
+    return processes, addresses
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run one shard of the face embedding gallery.')
+    parser.add_argument('--index', type=int, required=True, help='Index of this shard')
+    parser.add_argument('--num-shards', type=int, required=True, help='Total number of shards')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Interface to listen on (only expose shards on a trusted network)')
+    parser.add_argument('--port', type=int, default=6100, help='Port to listen on')
+    parser.add_argument('--mongo-uri', default=os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'),
+                        help='MongoDB to load this shard\'s partition from (empty to start empty)')
+    args = parser.parse_args()
+    try:
+        authkey = get_authkey()
+    except ValueError as e:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+        logger.error(str(e))
+        exit(1)
+    serve_shard((args.host, args.port), args.index, args.num_shards, authkey, mongo_uri=args.mongo_uri or None)
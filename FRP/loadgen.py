@@ -0,0 +1,569 @@
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from threading import Event, Lock, Thread
+from urllib.parse import urlparse
+
+import numpy as np
+import psutil
+import requests
+import socketio
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PORT = 5000  # app.py always listens here
+
+# Runs app.py against an in-memory mongomock database seeded in the same process
+MONGOMOCK_BOOTSTRAP = "import loadgen; loadgen.run_app_with_mongomock()"
+
+DEFAULT_SEED_FACES = 1000  # Gallery size for a spawned stand-in database
+
+# recognize_face messages for requests that return before embedding and matching run
+EARLY_RETURN_MESSAGES = ('No faces detected', 'No registered faces found')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def load_frames(frames_dir):
+    """Load a recorded frame sequence (JPEG/PNG files, in name order)."""
+    frames = []
+    for filename in sorted(os.listdir(frames_dir)):
+        if os.path.splitext(filename)[1].lower() not in ('.jpg', '.jpeg', '.png'):
+            continue
+        with open(os.path.join(frames_dir, filename), 'rb') as f:
+            frames.append((filename, f.read()))
+    if not frames:
+        raise ValueError(f"No JPEG or PNG frames found in {frames_dir}")
+    return frames
+
+
+def synthetic_frames(count, width, height, seed=0):
+    """Generate a sequence of noisy JPEG frames of the given size.
+
+    These contain no faces, so the server returns before FaceNet and
+    gallery matching run; they only measure the upload and detection path.
+    """
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(count):
+        # Shift and perturb the base frame so consecutive frames differ like a live feed
+        frame = np.roll(base, shift=i * 4, axis=1)
+        noise = rng.integers(-8, 9, size=frame.shape, dtype=np.int16)
+        frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(frame).save(buffer, format='JPEG', quality=85)
+        frames.append((f'frame_{i:05d}.jpg', buffer.getvalue()))
+    return frames
+
+
+def seed_faces(collection, count, seed=0, batch_size=1000):
+    """Register count random identities shaped like app.py registrations.
+
+    Encodings are random unit-norm 512-d vectors, like FaceNet output, so
+    every recognize request scans a gallery of realistic size.
+    """
+    if count <= 0:
+        return
+    rng = np.random.default_rng(seed)
+    timestamp = datetime.now()
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        encodings = rng.normal(size=(size, 512))
+        encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+        collection.insert_many([
+            {
+                "name": f"loadgen-{start + i:07d}",
+                "encoding": encoding.tolist(),
+                "timestamp": timestamp.isoformat(),
+                "created_at": timestamp
+            }
+            for i, encoding in enumerate(encodings)
+        ])
+    logger.info(f"Seeded {count} registered faces")
+
+
+def run_app_with_mongomock():
+    """Run app.py in this process against one shared, seeded mongomock client."""
+    import runpy
+    import mongomock
+    import pymongo
+
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: client
+    seed_faces(client['facial_recognition_db']['faces'], int(os.environ.get('LOADGEN_SEED_FACES', '0')))
+    runpy.run_path('app.py', run_name='__main__')
+
+
+class LoadStats:
+    """Thread-safe collector for latencies, drops and per-second throughput."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.http_latencies = []
+        self.socket_latencies = []
+        self.sent = 0
+        self.completed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.broadcasts = 0
+        self.response_messages = Counter()
+        self.completions_per_second = {}
+        self.rss_samples = []
+        self.last_completion = None
+
+    def record_http(self, latency, ok, second, message):
+        with self.lock:
+            self.last_completion = time.perf_counter()
+            self.response_messages[message] += 1
+            if ok:
+                self.completed += 1
+                self.http_latencies.append(latency)
+                self.completions_per_second[second] = self.completions_per_second.get(second, 0) + 1
+            else:
+                self.errors += 1
+
+    def record_socket(self, latency):
+        with self.lock:
+            self.socket_latencies.append(latency)
+
+    def record_sent(self):
+        with self.lock:
+            self.sent += 1
+
+    def record_dropped(self, count=1):
+        with self.lock:
+            self.dropped += count
+
+    def record_broadcast(self):
+        with self.lock:
+            self.broadcasts += 1
+
+    def record_rss(self, elapsed, rss_bytes):
+        with self.lock:
+            self.rss_samples.append((round(elapsed, 2), rss_bytes))
+
+    def summary(self, elapsed):
+        """Return the run report as a JSON-serializable dict."""
+        with self.lock:
+            http = sorted(self.http_latencies)
+            sock = sorted(self.socket_latencies)
+            offered = self.sent + self.dropped
+
+            def latency_ms(values):
+                report = {f'p{p}': round(percentile(values, p) * 1000, 2) if values else None for p in (50, 95, 99)}
+                report['max'] = round(values[-1] * 1000, 2) if values else None
+                report['count'] = len(values)
+                return report
+
+            rss_mb = [rss / (1024 ** 2) for _, rss in self.rss_samples]
+            return {
+                'duration_s': round(elapsed, 2),
+                'frames_offered': offered,
+                'frames_sent': self.sent,
+                'frames_completed': self.completed,
+                'frames_dropped': self.dropped,
+                'drop_rate': round(self.dropped / offered, 4) if offered else 0.0,
+                'errors': self.errors,
+                'throughput_fps': round(self.completed / elapsed, 2) if elapsed else 0.0,
+                'http_latency_ms': latency_ms(http),
+                'socketio_latency_ms': latency_ms(sock),
+                'socketio_broadcasts_received': self.broadcasts,
+                'response_messages': dict(self.response_messages.most_common()),
+                'server_rss_mb': {
+                    'start': round(rss_mb[0], 1) if rss_mb else None,
+                    'peak': round(max(rss_mb), 1) if rss_mb else None,
+                    'end': round(rss_mb[-1], 1) if rss_mb else None,
+                },
+                'rss_timeline': [(t, round(rss / (1024 ** 2), 1)) for t, rss in self.rss_samples],
+                'throughput_timeline': sorted(self.completions_per_second.items()),
+            }
+
+
+def next_frame_slot(tick, now, period, end_time):
+    """Return the next frame slot after tick and how many slots were missed.
+
+    Every slot that elapsed while the request sent at tick was in flight
+    (before now, and before end_time) counts as a dropped frame.
+    """
+    next_tick = tick + period
+    missed = 0
+    while next_tick < now and next_tick < end_time:
+        next_tick += period
+        missed += 1
+    return next_tick, missed
+
+
+class SimulatedCamera(Thread):
+    """Replays frames at a fixed fps, keeping at most one request in flight.
+
+    Like a real camera feed, a frame whose slot arrives while the previous
+    request is still outstanding is dropped rather than queued.
+    """
+
+    def __init__(self, camera_id, url, frames, fps, start_time, end_time, stats, timeout, use_socketio):
+        super().__init__(daemon=True)
+        self.camera_id = camera_id
+        self.url = url.rstrip('/')
+        self.frames = frames
+        self.period = 1.0 / fps
+        self.start_time = start_time
+        self.end_time = end_time
+        self.stats = stats
+        self.timeout = timeout
+        self.use_socketio = use_socketio
+        self.session = requests.Session()
+        self.sio = None
+        self.ping_seq = 0
+        self.ping_times = {}  # seq -> send time of pings awaiting a pong
+
+    def connect_socketio(self):
+        self.sio = socketio.Client(reconnection=True)
+
+        @self.sio.on('pong')
+        def on_pong(data):
+            sent_at = self.ping_times.pop(data.get('seq'), None) if isinstance(data, dict) else None
+            if sent_at is not None:
+                self.stats.record_socket(time.perf_counter() - sent_at)
+
+        @self.sio.on('connect')
+        def on_connect():
+            self.ping_times.clear()
+
+        @self.sio.on('disconnect')
+        def on_disconnect(*args):
+            # Pongs for pings sent before a reconnect never arrive
+            self.ping_times.clear()
+
+        @self.sio.on('face_recognized')
+        def on_face_recognized(data):
+            self.stats.record_broadcast()
+
+        self.sio.connect(self.url, transports=['websocket'], wait_timeout=self.timeout)
+
+    def run(self):
+        if self.use_socketio:
+            try:
+                self.connect_socketio()
+            except Exception as e:
+                logger.error(f"Camera {self.camera_id}: Socket.IO connection failed: {e}")
+                self.sio = None
+
+        # Stagger cameras across one frame period so they do not fire in lockstep
+        next_tick = self.start_time + self.period * (self.camera_id % 10) / 10.0
+        frame_index = 0
+        while next_tick < self.end_time:
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            filename, data = self.frames[frame_index % len(self.frames)]
+            frame_index += 1
+
+            if self.sio is not None and self.sio.connected:
+                self.ping_seq += 1
+                self.ping_times[self.ping_seq] = time.perf_counter()
+                self.sio.emit('ping', {'seq': self.ping_seq})
+
+            self.stats.record_sent()
+            sent_at = time.perf_counter()
+            try:
+                response = self.session.post(
+                    f'{self.url}/api/recognize',
+                    files={'image': (filename, data, 'image/jpeg' if filename.lower().endswith(('.jpg', '.jpeg')) else 'image/png')},
+                    timeout=self.timeout
+                )
+                ok = response.status_code == 200
+                try:
+                    body = response.json()
+                    message = body.get('message') or body.get('error') or f'HTTP {response.status_code}'
+                except ValueError:
+                    message = f'HTTP {response.status_code}'
+            except requests.RequestException as e:
+                logger.debug(f"Camera {self.camera_id}: request failed: {e}")
+                ok = False
+                message = type(e).__name__
+            now = time.perf_counter()
+            self.stats.record_http(now - sent_at, ok, int(now - self.start_time), message)
+
+            next_tick, missed = next_frame_slot(next_tick, now, self.period, self.end_time)
+            if missed:
+                self.stats.record_dropped(missed)
+
+        if self.sio is not None:
+            self.sio.disconnect()
+        self.session.close()
+
+
+def sample_rss(pid, stats, start_time, stop_event, interval):
+    """Record the server's RSS (including child processes) until stopped."""
+    try:
+        process = psutil.Process(pid)
+    except psutil.NoSuchProcess:
+        logger.error(f"Server process {pid} not found; RSS will not be reported")
+        return
+    while not stop_event.is_set():
+        try:
+            rss = process.memory_info().rss
+            rss += sum(child.memory_info().rss for child in process.children(recursive=True))
+        except psutil.NoSuchProcess:
+            logger.error("Server process exited during the run")
+            return
+        stats.record_rss(time.perf_counter() - start_time, rss)
+        stop_event.wait(interval)
+
+
+def url_port(url):
+    """Return the TCP port of a URL, defaulting by scheme."""
+    parsed = urlparse(url)
+    return parsed.port or (443 if parsed.scheme == 'https' else 80)
+
+
+def find_server_pid(port):
+    """Find the pid listening on a local TCP port, if visible to this user."""
+    try:
+        for conn in psutil.net_connections(kind='tcp'):
+            if conn.laddr and conn.laddr.port == port and conn.status == psutil.CONN_LISTEN and conn.pid:
+                return conn.pid
+    except psutil.AccessDenied:
+        pass
+    return None
+
+
+def wait_for_health(url, timeout, process=None):
+    """Poll /health until the server answers, timeout elapses or process exits."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            logger.error(f"Server exited during startup with code {process.returncode}")
+            return False
+        try:
+            if requests.get(f'{url}/health', timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+def start_mongod(port, dbpath):
+    """Start a throwaway local mongod to stand in for the production database."""
+    mongod = shutil.which('mongod')
+    if mongod is None:
+        raise RuntimeError("mongod not found on PATH; use --mongo mongomock or --mongo external")
+    process = subprocess.Popen(
+        [mongod, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    logger.info(f"Started local mongod on port {port} (dbpath {dbpath})")
+    return process
+
+
+def start_server(mongo_mode, mongo_uri, log_path, seed_count):
+    """Start app.py as a subprocess wired to the chosen Mongo stand-in."""
+    env = dict(os.environ)
+    env['MONGO_URI'] = mongo_uri
+    env['LOADGEN_SEED_FACES'] = str(seed_count)
+    if mongo_mode == 'mongomock':
+        command = [sys.executable, '-c', MONGOMOCK_BOOTSTRAP]
+    else:
+        command = [sys.executable, 'app.py']
+    # The child keeps its own copy of the log descriptor once started
+    with open(log_path, 'w') as log_file:
+        process = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    logger.info(f"Started app.py (pid {process.pid}), logging to {log_path}")
+    return process
+
+
+def print_report(report):
+    http = report['http_latency_ms']
+    sock = report['socketio_latency_ms']
+    rss = report['server_rss_mb']
+    print()
+    print(f"Duration:          {report['duration_s']} s")
+    print(f"Frames offered:    {report['frames_offered']}")
+    print(f"Frames completed:  {report['frames_completed']}")
+    print(f"Frames dropped:    {report['frames_dropped']} ({report['drop_rate'] * 100:.1f}%)")
+    print(f"Errors:            {report['errors']}")
+    print(f"Throughput:        {report['throughput_fps']} frames/s")
+    print(f"HTTP latency:      p50={http['p50']} ms  p95={http['p95']} ms  p99={http['p99']} ms  max={http['max']} ms")
+    print(f"Socket.IO latency: p50={sock['p50']} ms  p95={sock['p95']} ms  p99={sock['p99']} ms  ({sock['count']} pings)")
+    print(f"Broadcasts:        {report['socketio_broadcasts_received']} face_recognized events received")
+    print("Responses:         " + ', '.join(f"{m!r} x{n}" for m, n in report['response_messages'].items()))
+    print(f"Server RSS:        start={rss['start']} MB  peak={rss['peak']} MB  end={rss['end']} MB")
+    if report['rss_timeline']:
+        print("RSS over time:     " + ', '.join(f"{t}s={mb}MB" for t, mb in report['rss_timeline']))
+
+
+def run_load(args):
+    url = args.url.rstrip('/')
+    if args.frames_dir:
+        frames = load_frames(args.frames_dir)
+        logger.info(f"Loaded {len(frames)} recorded frames from {args.frames_dir}")
+    else:
+        width, height = (int(v) for v in args.frame_size.lower().split('x'))
+        frames = synthetic_frames(args.synthetic_count, width, height)
+        logger.info(f"Generated {len(frames)} synthetic {width}x{height} frames")
+
+    server_pid = args.server_pid
+    if server_pid is None:
+        port = url_port(url)
+        server_pid = find_server_pid(port)
+    if server_pid is None:
+        logger.warning("Could not determine server pid; pass --server-pid to report RSS")
+
+    stats = LoadStats()
+    start_time = time.perf_counter() + 1.0  # Give cameras time to connect before the first frame
+    end_time = start_time + args.duration
+    cameras = [
+        SimulatedCamera(i, url, frames, args.fps, start_time, end_time, stats, args.timeout, not args.no_socketio)
+        for i in range(args.cameras)
+    ]
+
+    stop_event = Event()
+    sampler = None
+    if server_pid is not None:
+        sampler = Thread(target=sample_rss, args=(server_pid, stats, start_time, stop_event, args.rss_interval), daemon=True)
+        sampler.start()
+
+    logger.info(f"Replaying {args.cameras} camera(s) at {args.fps} fps for {args.duration} s against {url}")
+    for camera in cameras:
+        camera.start()
+    for camera in cameras:
+        camera.join()
+    # Measure the load window only, not Socket.IO teardown after the last frame
+    elapsed = max((stats.last_completion or end_time), end_time) - start_time
+
+    stop_event.set()
+    if sampler is not None:
+        sampler.join()
+
+    report = stats.summary(elapsed)
+    early_returns = sum(report['response_messages'].get(m, 0) for m in EARLY_RETURN_MESSAGES)
+    if early_returns:
+        logger.warning(
+            f"{early_returns}/{report['frames_completed']} requests returned before embedding and matching "
+            "(no faces detected or no registered faces); latency and throughput understate the full pipeline"
+        )
+    report['config'] = {
+        'url': url,
+        'cameras': args.cameras,
+        'fps': args.fps,
+        'frames': len(frames),
+        'socketio': not args.no_socketio,
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay camera traffic against the face recognition server.')
+    parser.add_argument('--url', default='http://localhost:5000', help='Base URL of the server')
+    parser.add_argument('--cameras', type=int, default=4, help='Number of simulated cameras')
+    parser.add_argument('--fps', type=float, default=5.0, help='Frames per second per camera')
+    parser.add_argument('--duration', type=float, default=30.0, help='Run length in seconds')
+    parser.add_argument('--frames-dir', help='Directory of recorded JPEG/PNG frames containing faces to replay')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='Replay face-free noise frames instead of --frames-dir (upload/detection path only)')
+    parser.add_argument('--frame-size', default='640x480', help='Synthetic frame size, WIDTHxHEIGHT')
+    parser.add_argument('--synthetic-count', type=int, default=30, help='Number of distinct synthetic frames')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Per-request timeout in seconds')
+    parser.add_argument('--no-socketio', action='store_true', help='Only drive POST /api/recognize')
+    parser.add_argument('--server-pid', type=int, help='Server pid for RSS sampling (auto-detected if local)')
+    parser.add_argument('--rss-interval', type=float, default=1.0, help='Seconds between RSS samples')
+    parser.add_argument('--spawn-server', action='store_true', help='Start app.py for the run and stop it afterwards')
+    parser.add_argument('--mongo', choices=['external', 'mongod', 'mongomock'], default='mongod',
+                        help='Database for a spawned server: a throwaway mongod, in-memory mongomock, or --mongo-uri')
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/', help='MongoDB URI for --mongo external')
+    parser.add_argument('--mongod-port', type=int, default=27027, help='Port for the throwaway mongod')
+    parser.add_argument('--seed-faces', type=int, default=None,
+                        help=f'Random identities registered in a spawned mongod/mongomock before the run '
+                             f'(default {DEFAULT_SEED_FACES})')
+    parser.add_argument('--startup-timeout', type=float, default=180.0, help='Seconds to wait for a spawned server')
+    parser.add_argument('--output', help='Write the full JSON report to this file')
+    args = parser.parse_args()
+    if bool(args.frames_dir) == args.synthetic:
+        parser.error('pass exactly one of --frames-dir or --synthetic')
+    if args.spawn_server and url_port(args.url) != APP_PORT:
+        parser.error(f'--spawn-server starts app.py on port {APP_PORT}; --url must use that port')
+    if args.mongo == 'external' and args.seed_faces:
+        parser.error('--seed-faces only seeds a throwaway mongod or mongomock stand-in, not --mongo external')
+    if args.seed_faces is None:
+        args.seed_faces = 0 if args.mongo == 'external' else DEFAULT_SEED_FACES
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s'
+    )
+    if args.synthetic:
+        logger.warning("Synthetic frames contain no faces; the server will skip embedding and matching")
+
+    mongod_process = None
+    server_process = None
+    workdir = tempfile.mkdtemp(prefix='frp-loadgen-')
+    try:
+        if args.spawn_server:
+            mongo_uri = args.mongo_uri
+            if args.mongo == 'mongod':
+                dbpath = os.path.join(workdir, 'db')
+                os.makedirs(dbpath)
+                mongod_process = start_mongod(args.mongod_port, dbpath)
+                mongo_uri = f'mongodb://127.0.0.1:{args.mongod_port}/'
+                # Wait for mongod to accept connections so app.py does not exit on its 5 s ping
+                from pymongo import MongoClient
+                client = MongoClient(mongo_uri, serverSelectionTimeoutMS=30000)
+                client.admin.command('ping')
+                seed_faces(client['facial_recognition_db']['faces'], args.seed_faces)
+                client.close()
+            server_process = start_server(args.mongo, mongo_uri, os.path.join(workdir, 'server.log'),
+                                          args.seed_faces if args.mongo == 'mongomock' else 0)
+            if args.server_pid is None:
+                args.server_pid = server_process.pid
+            if not wait_for_health(args.url.rstrip('/'), args.startup_timeout, server_process):
+                logger.error(f"Server did not become healthy; see {os.path.join(workdir, 'server.log')}")
+                return 1
+        elif not wait_for_health(args.url.rstrip('/'), 5):
+            logger.error(f"Server at {args.url} is not healthy")
+            return 1
+
+        report = run_load(args)
+        print_report(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            logger.info(f"Report written to {args.output}")
+        return 0
+    finally:
+        for process in (server_process, mongod_process):
+            if process is not None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        if server_process is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            logger.info(f"Server log kept in {workdir}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import logging
+import os
+import signal
+import socket
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from gallery_shards import (
+    EMBEDDING_DIM,
+    HANDSHAKE_TIMEOUT,
+    GalleryShard,
+    ShardedGallery,
+    shard_for_name,
+    spawn_local_shards,
+)
+
+NUM_SHARDS = 3
+AUTHKEY = b'test-gallery-shards'
+
+
+def free_ports(count):
+    """Reserve and release count ephemeral ports on loopback."""
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+@pytest.fixture
+def shard_processes():
+    processes, addresses = spawn_local_shards(NUM_SHARDS, authkey=AUTHKEY, ports=free_ports(NUM_SHARDS))
+    yield processes, addresses
+    for process in processes:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGCONT)
+            process.terminate()
+        process.join()
+
+
+@pytest.fixture
+def gallery(shard_processes):
+    _, addresses = shard_processes
+    gallery = ShardedGallery(addresses, authkey=AUTHKEY)
+    deadline = time.time() + 10
+    while True:
+        try:
+            gallery.sizes()
+            break
+        except (ConnectionRefusedError, OSError):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+    yield gallery
+    gallery.close()
+
+
+def stop_shard(process):
+    process.terminate()
+    process.join()
+
+
+def brute_force(entries, query, k, threshold):
+    """Reference top-k: exact distances over the whole gallery, ordered by (distance, name)."""
+    matches = sorted(
+        (float(np.linalg.norm(query - embedding)), name)
+        for name, embedding in entries
+    )
+    return [match for match in matches if match[0] < threshold][:k]
+
+
+def unit(index, scale):
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    vector[index] = scale
+    return vector
+
+
+def test_sharded_search_matches_brute_force(gallery):
+    rng = np.random.default_rng(0)
+    entries = [(f'person-{i}', rng.normal(scale=0.03, size=EMBEDDING_DIM).astype(np.float32)) for i in range(60)]
+    assert gallery.load(entries) == gallery.sizes()
+    assert sum(gallery.sizes()) == len(entries)
+    assert all(size > 0 for size in gallery.sizes())
+
+    queries = np.stack([embedding for _, embedding in entries[:5]]) + 0.002
+    for query, matches in zip(queries, gallery.search(queries, k=4, threshold=1.0)):
+        expected = brute_force(entries, query, 4, 1.0)
+        assert [name for _, name in matches] == [name for _, name in expected]
+        assert np.allclose([d for d, _ in matches], [d for d, _ in expected], atol=1e-4)
+
+
+def test_threshold_and_equal_distance_tie_break(gallery):
+    # Pick two names owned by different shards so the tie is resolved by the coordinator merge
+    names = [f'tie-{i}' for i in range(20)]
+    first = names[0]
+    second = next(n for n in names if shard_for_name(n, NUM_SHARDS) != shard_for_name(first, NUM_SHARDS))
+    entries = [
+        (second, unit(1, 0.3)),
+        (first, unit(0, 0.3)),
+        ('far-away', unit(2, 2.0)),
+    ]
+    gallery.load(entries)
+    query = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+
+    matches = gallery.search([query], k=3, threshold=1.0)[0]
+    assert matches == brute_force(entries, query, 3, 1.0)
+    assert [name for _, name in matches] == sorted([first, second])
+    assert gallery.match(query) == (min(first, second), pytest.approx(0.3))
+
+
+def test_add_and_remove_route_to_owning_shard(gallery):
+    gallery.load([])
+    owner = shard_for_name('alice', NUM_SHARDS)
+
+    gallery.add('alice', unit(3, 0.1))
+    sizes = gallery.sizes()
+    assert sizes[owner] == 1 and sum(sizes) == 1
+    assert gallery.match(np.zeros(EMBEDDING_DIM))[0] == 'alice'
+
+    assert gallery.remove('alice') is True
+    assert gallery.remove('alice') is False
+    assert gallery.match(np.zeros(EMBEDDING_DIM)) == ('Unknown', float('inf'))
+
+
+def test_single_shard_search_orders_ties_by_name():
+    shard = GalleryShard()
+    shard.load([('bob', unit(0, 0.5)), ('alice', unit(1, 0.5)), ('carol', unit(2, 0.5))])
+    assert shard.search(np.zeros(EMBEDDING_DIM), k=2) == [[(0.5, 'alice'), (0.5, 'bob')]]
+
+
+def test_bad_peers_leave_shard_serving(gallery):
+    gallery.load([('alice', unit(0, 0.1))])
+    address = gallery.addresses[0]
+
+    # A port probe that connects and hangs up, and a peer that never speaks
+    socket.create_connection(address).close()
+    silent = socket.create_connection(address)
+    with pytest.raises(AuthenticationError):
+        Client(address, authkey=b'wrong-key')
+
+    # A fresh coordinator needs new connections, so every shard must still be accepting
+    fresh = ShardedGallery(gallery.addresses, authkey=AUTHKEY, timeout=HANDSHAKE_TIMEOUT / 2)
+    try:
+        assert sum(fresh.sizes()) == 1
+        assert fresh.match(np.zeros(EMBEDDING_DIM))[0] == 'alice'
+    finally:
+        fresh.close()
+        silent.close()
+
+
+@pytest.mark.parametrize('reorder', [lambda a: a[1:] + a[:1], lambda a: a[:-1]], ids=['reordered', 'missing'])
+def test_coordinator_refuses_mismatched_shard_list(gallery, reorder):
+    mismatched = ShardedGallery(reorder(gallery.addresses), authkey=AUTHKEY)
+    try:
+        with pytest.raises(RuntimeError, match='index/num_shards'):
+            mismatched.add('alice', unit(0, 0.1))
+        with pytest.raises(RuntimeError, match='All'):
+            mismatched.match(np.zeros(EMBEDDING_DIM))
+    finally:
+        mismatched.close()
+    assert sum(gallery.sizes()) == 0
+
+
+def test_search_merges_surviving_shards_with_warning(gallery, shard_processes, caplog):
+    processes, _ = shard_processes
+    entries = [(f'person-{i}', unit(i, 0.1)) for i in range(12)]
+    gallery.load(entries)
+    down = shard_for_name('person-0', NUM_SHARDS)
+    stop_shard(processes[down])
+
+    with caplog.at_level(logging.WARNING, logger='gallery_shards'):
+        matches = gallery.search([np.zeros(EMBEDDING_DIM)], k=len(entries))[0]
+    surviving = [(name, e) for name, e in entries if shard_for_name(name, NUM_SHARDS) != down]
+    assert matches == brute_force(surviving, np.zeros(EMBEDDING_DIM), len(entries), 1.0)
+    assert f'1/{NUM_SHARDS} gallery shards failed' in caplog.text
+
+
+def test_search_raises_when_every_shard_is_down(gallery, shard_processes):
+    processes, _ = shard_processes
+    for process in processes:
+        stop_shard(process)
+    with pytest.raises(RuntimeError, match=f'All {NUM_SHARDS} gallery shards failed'):
+        gallery.match(np.zeros(EMBEDDING_DIM))
+
+
+def test_reply_timeout_drops_pooled_connection(gallery, shard_processes):
+    processes, addresses = shard_processes
+    impatient = ShardedGallery(addresses, authkey=AUTHKEY, timeout=0.5)
+    try:
+        impatient.sizes()
+        assert all(len(idle) == 1 for idle in impatient.idle_connections)
+
+        os.kill(processes[0].pid, signal.SIGSTOP)
+        try:
+            with pytest.raises(TimeoutError):
+                impatient.sizes()
+            assert impatient.idle_connections[0] == []
+        finally:
+            os.kill(processes[0].pid, signal.SIGCONT)
+
+        # The next call reconnects instead of reading the stale reply
+        assert impatient.sizes() == [0] * NUM_SHARDS
+    finally:
+        impatient.close()
+
+
+def test_wrong_authkey_fails_every_shard(gallery):
+    intruder = ShardedGallery(gallery.addresses, authkey=b'wrong-key')
+    try:
+        with pytest.raises(AuthenticationError):
+            intruder.sizes()
+        with pytest.raises(RuntimeError, match='All'):
+            intruder.match(np.zeros(EMBEDDING_DIM))
+    finally:
+        intruder.close()
+    assert sum(gallery.sizes()) == 0
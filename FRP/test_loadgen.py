@@ -0,0 +1,86 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('psutil')
+pytest.importorskip('requests')
+pytest.importorskip('socketio')
+pytest.importorskip('PIL')
+
+from loadgen import LoadStats, next_frame_slot, percentile, url_port, wait_for_health
+
+
+def test_percentile_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile(values, 100) == 100.0
+    assert percentile([7.0], 99) == 7.0
+    assert percentile([1.0, 2.0, 3.0], 0) == 1.0
+    assert percentile([], 50) is None
+
+
+@pytest.mark.parametrize('tick, now, expected', [
+    (0.0, 0.125, (0.25, 0)),  # Finished within its own slot
+    (0.0, 0.25, (0.25, 0)),   # Finished exactly on the next slot
+    (0.0, 0.875, (1.0, 3)),   # Slots 0.25, 0.5 and 0.75 passed while in flight
+    (0.0, 5.0, (2.0, 7)),     # Slots at or after end_time are not counted
+])
+def test_next_frame_slot(tick, now, expected):
+    assert next_frame_slot(tick, now, 0.25, end_time=2.0) == expected
+
+
+def test_summary_reports_rates_latencies_and_rss():
+    stats = LoadStats()
+    for i in range(100):
+        stats.record_sent()
+        stats.record_http((i + 1) / 1000.0, True, i // 50, 'Detected 1 face(s)')
+    for _ in range(5):
+        stats.record_sent()
+        stats.record_http(2.0, False, 1, 'HTTP 500')
+    stats.record_dropped(45)
+    for elapsed, mb in [(0.0, 100), (1.0, 180), (2.0, 150)]:
+        stats.record_rss(elapsed, mb * 1024 ** 2)
+
+    report = stats.summary(elapsed=4.0)
+
+    assert report['frames_offered'] == 150
+    assert report['frames_completed'] == 100
+    assert report['frames_dropped'] == 45
+    assert report['drop_rate'] == 0.3
+    assert report['errors'] == 5
+    assert report['throughput_fps'] == 25.0
+    assert report['http_latency_ms'] == {'p50': 50.0, 'p95': 95.0, 'p99': 99.0, 'max': 100.0, 'count': 100}
+    assert report['socketio_latency_ms']['p50'] is None
+    assert report['response_messages'] == {'Detected 1 face(s)': 100, 'HTTP 500': 5}
+    assert report['server_rss_mb'] == {'start': 100.0, 'peak': 180.0, 'end': 150.0}
+    assert report['throughput_timeline'] == [(0, 50), (1, 50)]
+
+
+def test_summary_of_empty_run():
+    report = LoadStats().summary(elapsed=1.0)
+    assert report['drop_rate'] == 0.0
+    assert report['throughput_fps'] == 0.0
+    assert report['server_rss_mb'] == {'start': None, 'peak': None, 'end': None}
+
+
+def test_wait_for_health_stops_when_server_exits():
+    process = subprocess.Popen([sys.executable, '-c', 'raise SystemExit(1)'])
+    process.wait()
+    started = time.time()
+    assert wait_for_health('http://127.0.0.1:9', 60, process) is False
+    assert time.time() - started < 5
+
+
+@pytest.mark.parametrize('url, port', [
+    ('http://localhost:5000', 5000),
+    ('http://example.com', 80),
+    ('https://example.com/', 443),
+    ('https://example.com:8443', 8443),
+])
+def test_url_port(url, port):
+    assert url_port(url) == port